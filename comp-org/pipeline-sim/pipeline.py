@@ -0,0 +1,564 @@
+"""
+Reference simulator for the five-stage pipeline project
+(IF, ID, EX, MEM, WB) with data-hazard detection, forwarding,
+and branch stall modeling. Used as the grading oracle for
+student cycle counts and stall / forward decisions.
+
+MODEL
+
+Instead of shuffling instruction objects from latch to latch
+every clock tick, the simulator computes, for each instruction
+in order, the cycle in which it enters IF, ID and EX. MEM and
+WB always follow EX by one and two cycles (nothing stalls after
+EX in this pipeline). Those three cycles are kept in flat arrays
+(one slot per instruction), which is all that is needed to
+redraw the timing diagram and keeps a trace of a million or more
+instructions cheap to simulate.
+
+Timing rules (Patterson & Hennessy, Ch. 4):
+
+- The register file is written in the first half of WB and read
+  in the second half of ID.
+- With forwarding, an ALU result can be used by the very next
+  instruction (EX/MEM -> EX). A load followed by a use of its
+  destination costs one stall (load-use hazard).
+- Without forwarding, a consumer waits in ID until its producer
+  reaches WB (two stalls for back-to-back dependences).
+- Branches are resolved in ID (default), EX or MEM. A branch
+  resolved in ID needs its operands in ID, so it stalls one cycle
+  behind an ALU producer and two behind a load.
+- Branch policy "predict" (predict not taken) only pays when the
+  branch is taken; policy "stall" always holds fetch until the
+  branch resolves.
+
+CPI is reported as (cycles - 4) / instructions, i.e. it leaves
+out the four cycles needed to fill the pipeline, so that
+CPI = 1 + stall cycles / instructions.
+
+Usage:
+
+    python pipeline.py                     # self-check and demo
+    python pipeline.py traces/*.s          # batch summary
+    python pipeline.py -d 20 traces/loop.s # plus timing diagrams
+    python pipeline.py --random 1000000    # synthetic stress trace
+
+EDCI 5004 Computer Organization for Educators
+"""
+
+import argparse
+import random
+import re
+import sys
+from array import array
+
+STAGES = ('IF', 'ID', 'EX', 'MEM', 'WB')
+FILL_CYCLES = len(STAGES) - 1
+
+# Instruction kinds
+ALU, LOAD, STORE, BRANCH, NOP = range(5)
+
+# r0-r15, plus a pseudo-register for the condition flags (NZCV)
+FLAGS = 16
+NUM_REGS = 17
+REG_NAMES = [f'r{i}' for i in range(16)] + ['flags']
+REG_ALIASES = {'sp': 13, 'lr': 14, 'pc': 15}
+
+RESOLVE_STAGES = ('ID', 'EX', 'MEM')
+BRANCH_POLICIES = ('predict', 'stall')
+
+ALU_OPS = {
+    'ADD', 'ADC', 'SUB', 'SBC', 'RSB', 'MUL', 'AND', 'ORR', 'EOR',
+    'BIC', 'LSL', 'LSR', 'ASR', 'ROR', 'MOV', 'MVN',
+}
+COMPARE_OPS = {'CMP', 'CMN', 'TST', 'TEQ'}
+LOAD_OPS = {'LDR', 'LDRB', 'LDRH', 'LDRSB', 'LDRSH'}
+STORE_OPS = {'STR', 'STRB', 'STRH'}
+CONDITIONS = {
+    'EQ', 'NE', 'CS', 'HS', 'CC', 'LO', 'MI', 'PL', 'VS', 'VC',
+    'HI', 'LS', 'GE', 'LT', 'GT', 'LE', 'AL',
+}
+
+REG_RE = re.compile(r'\b(r1[0-5]|r[0-9]|sp|lr|pc)\b', re.IGNORECASE)
+LABEL_RE = re.compile(r'^\s*[A-Za-z_.$][\w.$]*:')
+COMMENT_RE = re.compile(r'(@|;|//).*')
+
+
+class Instr:
+    """
+    One decoded instruction. Instances are immutable in practice
+    and shared between every occurrence of the same source line,
+    so a loop that runs a million times decodes only once.
+    """
+    __slots__ = ('text', 'op', 'kind', 'dsts', 'srcs', 'taken')
+
+    def __init__(self, text, op, kind, dsts=(), srcs=(), taken=False):
+        self.text = text
+        self.op = op
+        self.kind = kind
+        self.dsts = dsts
+        self.srcs = srcs
+        self.taken = taken
+
+    def __repr__(self):
+        return f'Instr({self.text!r})'
+
+
+def _reg_numbers(operands):
+    """
+    Register numbers named in an operand string, in order.
+    """
+    regs = []
+    for name in REG_RE.findall(operands):
+        name = name.lower()
+        regs.append(REG_ALIASES[name] if name in REG_ALIASES
+                    else int(name[1:]))
+    return regs
+
+
+def _unique(regs):
+    """
+    Source registers without repeats, so ADD r2, r1, r1 is checked
+    (and forwarded) once for r1.
+    """
+    return tuple(dict.fromkeys(regs))
+
+
+def _branch_op(op):
+    """
+    Split a branch mnemonic into (base, condition), or return
+    None if op is not a branch.
+    """
+    for base in ('BX', 'BL', 'B'):
+        if op.startswith(base):
+            cond = op[len(base):]
+            if cond == '' or cond in CONDITIONS:
+                return base, cond
+    return None
+
+
+def decode(line):
+    """
+    Decode one line of ARM-like assembly into an Instr, or return
+    None for blank, comment-only or label-only lines.
+
+    Conditional branches are taken unless followed by N (for
+    example ``BNE loop, N``); an optional T marks them taken
+    explicitly. Trace files list instructions in the order they
+    were executed, so no branch targets are followed.
+    """
+    text = COMMENT_RE.sub('', line)
+    text = LABEL_RE.sub('', text).strip()
+    if not text:
+        return None
+    op, _, operands = text.partition(' ')
+    op = op.upper()
+    operands = operands.strip()
+    regs = _reg_numbers(operands)
+
+    if op == 'NOP':
+        return Instr(text, op, NOP)
+
+    branch = _branch_op(op)
+    if branch is not None:
+        base, cond = branch
+        fields = [f.strip() for f in operands.split(',')]
+        taken = True
+        if cond not in ('', 'AL') and len(fields) > 1:
+            outcome = fields[-1].upper()
+            if outcome not in ('T', 'N'):
+                raise ValueError(f'branch outcome must be T or N: {line!r}')
+            taken = outcome == 'T'
+        srcs = _unique(regs) if base == 'BX' else ()
+        if cond not in ('', 'AL'):
+            srcs += (FLAGS,)
+        dsts = (REG_ALIASES['lr'],) if base == 'BL' else ()
+        return Instr(text, op, BRANCH, dsts, srcs, taken)
+
+    if op in LOAD_OPS:
+        if not regs:
+            raise ValueError(f'load needs a destination register: {line!r}')
+        return Instr(text, op, LOAD, (regs[0],), _unique(regs[1:]))
+
+    if op in STORE_OPS:
+        return Instr(text, op, STORE, (), _unique(regs))
+
+    if op in COMPARE_OPS:
+        return Instr(text, op, ALU, (FLAGS,), _unique(regs))
+
+    sets_flags = op.endswith('S') and op[:-1] in ALU_OPS
+    if op in ALU_OPS or sets_flags:
+        if not regs:
+            raise ValueError(f'{op} needs a destination register: {line!r}')
+        dsts = (regs[0], FLAGS) if sets_flags else (regs[0],)
+        return Instr(text, op, ALU, dsts, _unique(regs[1:]))
+
+    raise ValueError(f'unsupported instruction: {line!r}')
+
+
+def parse(lines):
+    """
+    Decode an iterable of assembly lines into a list of Instr.
+    Identical lines share one Instr object.
+    """
+    cache = {}
+    program = []
+    for number, line in enumerate(lines, start=1):
+        instr = cache.get(line)
+        if instr is None:
+            try:
+                instr = decode(line)
+            except ValueError as e:
+                raise ValueError(f'line {number}: {e}') from None
+            if instr is None:
+                continue
+            cache[line] = instr
+        program.append(instr)
+    return program
+
+
+def load_trace(path):
+    """
+    Read and decode a trace file.
+    """
+    with open(path, encoding='UTF8') as f:
+        return parse(f)
+
+
+class Result:
+    """
+    Outcome of one simulation run. fetch, decode and execute hold
+    the cycle (counting from 1) in which each instruction enters
+    IF, ID and EX; MEM and WB are execute + 1 and execute + 2.
+    """
+    __slots__ = ('name', 'program', 'fetch', 'decode', 'execute',
+                 'cycles', 'data_stalls', 'control_stalls', 'forwards',
+                 'forwarding', 'policy', 'resolve')
+
+    @property
+    def instructions(self):
+        return len(self.program)
+
+    @property
+    def stalls(self):
+        return self.data_stalls + self.control_stalls
+
+    @property
+    def cpi(self):
+        if not self.program:
+            return 0.0
+        return (self.cycles - FILL_CYCLES) / len(self.program)
+
+
+def simulate(program, forwarding=True, policy='predict', resolve='ID',
+             name=''):
+    """
+    Run a decoded program through the pipeline and return a Result.
+    """
+    if policy not in BRANCH_POLICIES:
+        raise ValueError(f'policy must be one of {BRANCH_POLICIES}')
+    if resolve not in RESOLVE_STAGES:
+        raise ValueError(f'resolve must be one of {RESOLVE_STAGES}')
+
+    n = len(program)
+    fetch = array('l', [0]) * n
+    decode_ = array('l', [0]) * n
+    execute = array('l', [0]) * n
+
+    # ready[r]: earliest cycle the value of r can be picked up by a
+    # consumer in its operand stage; wb[r]: the producer's WB cycle.
+    ready = [0] * NUM_REGS
+    wb = [0] * NUM_REGS
+
+    # Operands are read in EX when forwarding, otherwise in ID.
+    # A branch resolved in ID always reads its operands in ID.
+    read_offset = 0 if forwarding else 1
+    branch_offset = 1 if (resolve == 'ID' or not forwarding) else 0
+    # Cycle, relative to EX, in which the branch outcome is known
+    resolve_delta = RESOLVE_STAGES.index(resolve) - 1
+    always_stall = policy == 'stall'
+
+    # A virtual predecessor leaves IF in cycle 1 and ID in cycle 2,
+    # so the first instruction enters IF in cycle 1.
+    d_prev, e_prev = 1, 2
+    next_fetch = 0
+    data_stalls = control_stalls = forwards = 0
+
+    for i in range(n):
+        instr = program[i]
+        kind = instr.kind
+
+        f = d_prev if d_prev > next_fetch else next_fetch
+        next_fetch = 0
+        d = f + 1 if f + 1 > e_prev else e_prev
+        control_stalls += d - e_prev
+
+        e = d + 1
+        offset = branch_offset if kind == BRANCH else read_offset
+        for r in instr.srcs:
+            need = ready[r] + offset
+            if need > e:
+                e = need
+        data_stalls += e - d - 1
+        if forwarding:
+            for r in instr.srcs:
+                if e <= wb[r]:
+                    forwards += 1
+
+        if instr.dsts:
+            w = e + 2
+            if not forwarding:
+                avail = w
+            elif kind == LOAD:
+                avail = e + 2
+            else:
+                avail = e + 1
+            for r in instr.dsts:
+                ready[r] = avail
+                wb[r] = w
+
+        if kind == BRANCH and (always_stall or instr.taken):
+            next_fetch = e + resolve_delta + 1
+
+        fetch[i] = f
+        decode_[i] = d
+        execute[i] = e
+        d_prev, e_prev = d, e
+
+    result = Result()
+    result.name = name
+    result.program = program
+    result.fetch = fetch
+    result.decode = decode_
+    result.execute = execute
+    result.cycles = e_prev + 2 if n else 0
+    result.data_stalls = data_stalls
+    result.control_stalls = control_stalls
+    result.forwards = forwards
+    result.forwarding = forwarding
+    result.policy = policy
+    result.resolve = resolve
+    return result
+
+
+def hazard_notes(result, i):
+    """
+    Describe the stalls and forwards seen by instruction i, e.g.
+    ['1 stall', 'r1 EX/MEM->EX']. Recomputed on demand so the
+    simulation loop does not have to record them.
+    """
+    program = result.program
+    instr = program[i]
+    d, e = result.decode[i], result.execute[i]
+    notes = []
+
+    if i and d - result.execute[i - 1] > 0:
+        bubbles = d - result.execute[i - 1]
+        notes.append(f'{bubbles} branch bubble' + 's' * (bubbles > 1))
+    if e - d - 1 > 0:
+        stalls = e - d - 1
+        notes.append(f'{stalls} stall' + 's' * (stalls > 1))
+
+    if not result.forwarding:
+        return notes
+    in_id = instr.kind == BRANCH and result.resolve == 'ID'
+    target = 'ID' if in_id else 'EX'
+    for r in instr.srcs:
+        # A forwarded value comes from at most two instructions back.
+        for j in (i - 1, i - 2):
+            if j < 0 or r not in program[j].dsts:
+                continue
+            e_j = result.execute[j]
+            read = e - 1 if in_id else e
+            if read == e_j + 1:
+                notes.append(f'{REG_NAMES[r]} EX/MEM->{target}')
+            elif read == e_j + 2 and not in_id:
+                notes.append(f'{REG_NAMES[r]} MEM/WB->{target}')
+            break
+    return notes
+
+
+def timing_diagram(result, limit=None):
+    """
+    Return the cycle-by-cycle timing diagram for the first `limit`
+    instructions (all of them if limit is None) as a string. Cycles
+    an instruction spends held in IF or ID are drawn as '--'.
+    """
+    program = result.program
+    count = len(program) if limit is None else min(limit, len(program))
+    if not count:
+        return ''
+    last = result.execute[count - 1] + 2
+    width = max(len(instr.text) for instr in program[:count])
+    cell = 4
+
+    header = ' ' * width + ' |' + ''.join(
+        f'{c:>{cell}}' for c in range(1, last + 1))
+    lines = [header, '-' * len(header)]
+    for i in range(count):
+        f, d, e = result.fetch[i], result.decode[i], result.execute[i]
+        cells = [''] * (last + 1)
+        cells[f] = 'IF'
+        for c in range(f + 1, d):
+            cells[c] = '--'
+        cells[d] = 'ID'
+        for c in range(d + 1, e):
+            cells[c] = '--'
+        cells[e], cells[e + 1], cells[e + 2] = 'EX', 'MEM', 'WB'
+        row = ''.join(f'{s:>{cell}}' for s in cells[1:])
+        notes = ', '.join(hazard_notes(result, i))
+        line = f'{program[i].text:<{width}} |{row}'
+        lines.append(f'{line}  {notes}'.rstrip())
+    return '\n'.join(lines)
+
+
+def summary_table(results):
+    """
+    One line per simulated trace: counts, stalls and CPI.
+    """
+    width = max([5] + [len(r.name) for r in results])
+    header = (f'{"trace":<{width}} {"instrs":>9} {"cycles":>9} '
+              f'{"data":>8} {"ctrl":>8} {"fwds":>8} {"CPI":>7}')
+    lines = [header, '-' * len(header)]
+    for r in results:
+        lines.append(
+            f'{r.name:<{width}} {r.instructions:>9} {r.cycles:>9} '
+            f'{r.data_stalls:>8} {r.control_stalls:>8} '
+            f'{r.forwards:>8} {r.cpi:>7.3f}'
+        )
+    return '\n'.join(lines)
+
+
+def random_trace(n, seed=0):
+    """
+    Synthetic instruction stream of length n with a realistic mix
+    of ALU ops, loads, stores and branches, for stress testing.
+    """
+    rng = random.Random(seed)
+    templates = [
+        (40, 'ADD r{0}, r{1}, r{2}'),
+        (10, 'SUB r{0}, r{1}, #4'),
+        (20, 'LDR r{0}, [r{1}, #8]'),
+        (10, 'STR r{0}, [r{1}]'),
+        (8, 'CMP r{0}, r{1}'),
+        (8, 'BNE loop, {3}'),
+        (4, 'B next'),
+    ]
+    weights = [w for w, _ in templates]
+    forms = [t for _, t in templates]
+    lines = []
+    for form in rng.choices(forms, weights, k=n):
+        lines.append(form.format(rng.randrange(8), rng.randrange(8),
+                                 rng.randrange(8), rng.choice('TN')))
+    return parse(lines)
+
+
+EXAMPLE = """\
+    LDR r1, [r0, #0]
+    ADD r2, r1, r1      @ load-use: one stall
+    SUB r3, r2, #1      @ forwarded from EX/MEM
+    STR r3, [r0, #4]
+    CMP r3, #0
+    BNE loop, T         @ taken: flush the fall-through fetch
+    ADD r4, r4, #1
+"""
+
+
+def _check():
+    """
+    Textbook cases, in the same spirit as the asserts in ripple.py.
+    """
+    def run(source, **kwargs):
+        return simulate(parse(source.splitlines()), **kwargs)
+
+    # No hazards: n + 4 cycles, CPI 1
+    r = run('ADD r1, r2, r3\nSUB r4, r5, r6\nAND r7, r8, r9')
+    assert r.cycles == 7 and r.stalls == 0 and r.cpi == 1.0
+
+    # ALU -> ALU: forwarded with no stall, two stalls without forwarding
+    src = 'ADD r1, r2, r3\nSUB r4, r1, r5'
+    r = run(src)
+    assert r.data_stalls == 0 and r.forwards == 1
+    assert hazard_notes(r, 1) == ['r1 EX/MEM->EX']
+    r = run(src, forwarding=False)
+    assert r.data_stalls == 2 and r.forwards == 0
+
+    # One instruction between: MEM/WB forward, or one stall without
+    src = 'ADD r1, r2, r3\nNOP\nSUB r4, r1, r5'
+    assert hazard_notes(run(src), 2) == ['r1 MEM/WB->EX']
+    assert run(src, forwarding=False).data_stalls == 1
+
+    # Load-use hazard: one stall even with forwarding
+    r = run('LDR r1, [r2]\nADD r3, r1, r1')
+    assert r.data_stalls == 1 and r.cycles == 7
+    assert hazard_notes(r, 1) == ['1 stall', 'r1 MEM/WB->EX']
+
+    # Branch resolved in ID after CMP (ALU) stalls one cycle
+    r = run('CMP r1, r2\nBEQ done, N\nADD r3, r3, r3')
+    assert r.data_stalls == 1 and r.control_stalls == 0
+
+    # Taken branch costs 1, 2 or 3 bubbles depending on where it resolves
+    src = 'B loop\nADD r1, r2, r3'
+    for stage, bubbles in zip(RESOLVE_STAGES, (1, 2, 3)):
+        assert run(src, resolve=stage).control_stalls == bubbles
+
+    # Predict-not-taken is free for a not-taken branch; stall is not
+    src = 'BEQ out, N\nADD r1, r2, r3'
+    assert run(src).control_stalls == 0
+    assert run(src, policy='stall').control_stalls == 1
+
+    # CPI excludes pipeline fill
+    r = run(EXAMPLE)
+    assert r.cpi == 1 + r.stalls / r.instructions
+    assert r.cycles == r.instructions + FILL_CYCLES + r.stalls
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Five-stage pipeline reference simulator.')
+    parser.add_argument('traces', nargs='*', help='trace files to simulate')
+    parser.add_argument('--no-forwarding', dest='forwarding',
+                        action='store_false', help='disable forwarding')
+    parser.add_argument('--policy', choices=BRANCH_POLICIES,
+                        default='predict', help='branch handling')
+    parser.add_argument('--resolve', choices=RESOLVE_STAGES, default='ID',
+                        help='stage in which branches are resolved')
+    parser.add_argument('-d', '--diagram', type=int, metavar='N',
+                        help='print timing diagram for first N instructions')
+    parser.add_argument('--random', type=int, metavar='N',
+                        help='also simulate a random trace of N instructions')
+    args = parser.parse_args(argv)
+    options = dict(forwarding=args.forwarding, policy=args.policy,
+                   resolve=args.resolve)
+
+    if not args.traces and args.random is None:
+        _check()
+        result = simulate(parse(EXAMPLE.splitlines()), name='example',
+                          **options)
+        print(timing_diagram(result))
+        print()
+        print(summary_table([result]))
+        return 0
+
+    results = []
+    for path in args.traces:
+        try:
+            program = load_trace(path)
+        except (OSError, ValueError) as e:
+            print(f'{path}: {e}', file=sys.stderr)
+            return 1
+        results.append(simulate(program, name=path, **options))
+    if args.random is not None:
+        results.append(simulate(random_trace(args.random),
+                                name=f'random({args.random})', **options))
+
+    for result in results:
+        if args.diagram:
+            print(result.name)
+            print(timing_diagram(result, args.diagram))
+            print()
+    print(summary_table(results))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,9 @@
+@ Straight-line code that hits each data hazard once.
+    LDR r1, [r0, #0]
+    ADD r2, r1, r1      @ load-use: one stall
+    SUB r3, r2, #1      @ EX/MEM -> EX
+    ORR r4, r2, r3      @ MEM/WB -> EX and EX/MEM -> EX
+    STR r4, [r0, #4]    @ EX/MEM -> EX
+    LDR r5, [r0, #8]
+    NOP
+    ADD r6, r5, r4      @ load one instruction back: no stall
@@ -0,0 +1,17 @@
+@ Three iterations of an array-sum loop, as executed.
+    MOV r2, #0          @ sum
+    MOV r3, #3          @ count
+loop:
+    LDR r1, [r0], #4
+    ADD r2, r2, r1      @ load-use
+    SUBS r3, r3, #1
+    BNE loop, T         @ flags needed in ID
+    LDR r1, [r0], #4
+    ADD r2, r2, r1
+    SUBS r3, r3, #1
+    BNE loop, T
+    LDR r1, [r0], #4
+    ADD r2, r2, r1
+    SUBS r3, r3, #1
+    BNE loop, N         @ falls through
+    STR r2, [r0]